@@ -1,54 +1,578 @@
+import hashlib
+import heapq
+import json
+import logging
+import math
+import struct
+import sys
 import time
 import threading
-from collections import OrderedDict
-from typing import Any, Optional, Dict
-from flask import Flask, request, jsonify
-from datetime import datetime, timedelta
+import weakref
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Dict, List, NamedTuple, Tuple
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class InMemoryCache:
+try:
+    import uwsgi  # Only importable when running under uWSGI
+except ImportError:
+    uwsgi = None
+
+logger = logging.getLogger(__name__)
+
+# Expiration time of entries that never expire (monotonic nanoseconds)
+NEVER = sys.maxsize
+
+# (value, fresh) returned by a core's peek for a missing or expired key
+_MISS = (None, False)
+
+
+class _CacheCore:
     """
-    A thread-safe in-memory cache with TTL and LRU eviction support.
+    Pure-Python storage core for a shard, used when the compiled
+    _cache_core extension is not available.
+
+    Entries are stored column-wise in parallel slot arrays, with a dict
+    mapping each key to its slot. Eviction uses CLOCK (second chance):
+    reads only set the slot's reference bit, and the clock hand sweeps
+    forward clearing bits until it reaches an unreferenced entry.
+
+    Each slot also has a sequence number that writers make odd while they
+    change the slot and even again once done, so a lock-free read can tell
+    that the slot was rewritten under it, even if it ends up holding the
+    same key again, and read it again.
     """
 
-    def __init__(self, max_size: int = 1000, default_ttl: int = 3600):
+    def __init__(self, max_size: int = 0):
+        self._slots: Dict[str, int] = {}
+        self._keys: List[Optional[str]] = [None] * max_size
+        self._values: List[Any] = [None] * max_size
+        self._expires = array('q', [NEVER]) * max_size
+        self._fresh = array('q', [NEVER]) * max_size
+        self._bits = bytearray(max_size)
+        self._seqs = array('Q', [0]) * max_size
+        self._free: List[int] = list(range(max_size - 1, -1, -1))
+        self._hand = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slots
+
+    def peek(self, key: str, now: int) -> Tuple[Optional[Any], bool]:
         """
-        Initialize the cache.
+        Return (value, fresh) for key and mark it referenced, or (None, False)
+        if missing or expired.
+        """
+        # Reads take no lock, so read the slot again if a writer was
+        # changing it or has changed it since
+        while True:
+            slot = self._slots.get(key)
+            if slot is None:
+                return _MISS
+
+            seq = self._seqs[slot]
+            if seq & 1:
+                time.sleep(0)  # A writer is mid-update; yield the GIL so it can finish
+                continue
+
+            stored_key = self._keys[slot]
+            value = self._values[slot]
+            expires_at = self._expires[slot]
+            fresh_until = self._fresh[slot]
+            if self._seqs[slot] == seq:
+                break
+
+        if stored_key != key or now > expires_at:
+            return _MISS
+
+        self._bits[slot] = 1
+        return value, now <= fresh_until
+
+    def put(self, key: str, value: Any, expires_at: int, fresh_until: int):
+        """
+        Store value, replacing any existing entry (expires_at NEVER for no
+        expiration). Between fresh_until and expires_at the value is stale.
+        """
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._keys)
+                self._keys.append(None)
+                self._values.append(None)
+                self._expires.append(NEVER)
+                self._fresh.append(NEVER)
+                self._bits.append(0)
+                self._seqs.append(0)
+
+        self._seqs[slot] += 1
+        self._keys[slot] = key
+        self._values[slot] = value
+        self._expires[slot] = expires_at
+        self._fresh[slot] = fresh_until
+        self._seqs[slot] += 1
+        self._slots[key] = slot
+
+    def pop(self, key: str) -> int:
+        """Remove key and return its expiration time."""
+        slot = self._slots.pop(key)
+        self._seqs[slot] += 1
+        self._keys[slot] = None
+        self._values[slot] = None
+        self._seqs[slot] += 1
+        self._bits[slot] = 0
+        self._free.append(slot)
+        return self._expires[slot]
+
+    def victim(self) -> str:
+        """Advance the clock hand to an unreferenced entry and return its key."""
+        if not self._slots:
+            raise KeyError('victim(): cache core is empty')
+
+        keys, bits = self._keys, self._bits
+        hand = self._hand
+        while True:
+            if hand >= len(keys):
+                hand = 0
+            if keys[hand] is not None:
+                if not bits[hand]:
+                    self._hand = hand + 1
+                    return keys[hand]
+                bits[hand] = 0  # Second chance
+            hand += 1
+
+    def expires_at(self, key: str) -> int:
+        """Return the expiration time of key (NEVER if missing or it never expires)."""
+        slot = self._slots.get(key)
+        return NEVER if slot is None else self._expires[slot]
+
+    def fresh_until(self, key: str) -> int:
+        """Return the time key stops being fresh (NEVER if missing or it never expires)."""
+        slot = self._slots.get(key)
+        return NEVER if slot is None else self._fresh[slot]
+
+    def clear(self):
+        """Remove all entries."""
+        for slot in self._slots.values():
+            self._seqs[slot] += 1
+            self._keys[slot] = None
+            self._values[slot] = None
+            self._seqs[slot] += 1
+            self._bits[slot] = 0
+            self._free.append(slot)
+        self._slots.clear()
+
+
+try:
+    from _cache_core import CacheCore
+except ImportError:
+    CacheCore = _CacheCore
+
+
+class _Slab:
+    """
+    Entries of one size class within a shard, with their own eviction order
+    and byte budget.
+    """
+
+    __slots__ = ('core', 'budget', 'used', 'sizes', 'hits', 'failures')
+
+    def __init__(self, max_size: int, budget: int):
+        self.core = CacheCore(max_size)
+        self.budget = budget
+        self.used = 0
+        self.sizes: Dict[str, int] = {}
+
+        # Counters read and reset by the rebalancer
+        self.hits = 0
+        # Allocation failures: entries evicted to fit a new one in the budget,
+        # and values rejected for being larger than the whole budget
+        self.failures = 0
+
+
+class _CacheShard:
+    """
+    One independently locked partition of an InMemoryCache.
+
+    Entries are split into slabs by size class so small hot entries are not
+    pushed out by large ones; each slab evicts within its own byte budget.
+    """
+
+    # Superseded expiry heap entries tolerated before the heap is rebuilt
+    HEAP_SLACK = 64
+
+    # Monotonic clock in integer nanoseconds, bound once at class scope
+    _now = time.monotonic_ns
+
+    def __init__(self, max_size: int, slab_limits: Tuple[int, ...], slab_budgets: Tuple[int, ...]):
+        """
+        Initialize the shard.
 
         Args:
-            max_size: Maximum number of items in cache
-            default_ttl: Default time-to-live in seconds
+            max_size: Maximum number of items in this shard
+            slab_limits: Upper size bound of each slab but the last, which takes the rest
+            slab_budgets: Initial byte budget of each slab
         """
         self.max_size = max_size
-        self.default_ttl = default_ttl
-        self._cache = OrderedDict()
-        self._lock = threading.RLock()
+        self.lock = threading.Lock()
+
+        self.slab_limits = slab_limits
+        slab_size = max(1, max_size // len(slab_budgets))
+        self.slabs: List[_Slab] = [_Slab(slab_size, budget) for budget in slab_budgets]
+        self._slab_of: Dict[str, _Slab] = {}
 
-    def _is_expired(self, item: Dict) -> bool:
+        # Min-heap of (expires_at, key) so the sweeper only visits entries
+        # that are due. Entries are never removed early; ones whose key has
+        # since been deleted or stored again are skipped when popped
+        self._expiry_heap: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._slab_of)
+
+    def _is_expired(self, key: str) -> bool:
         """Check if a cache item has expired."""
-        if item['ttl'] is None:
+        slab = self._slab_of.get(key)
+        return slab is not None and self._now() > slab.core.expires_at(key)
+
+    def _remove(self, key: str):
+        """Remove a key from its slab."""
+        slab = self._slab_of.pop(key)
+        slab.used -= slab.sizes.pop(key)
+        slab.core.pop(key)
+
+    def _evict(self, slab: _Slab):
+        """Remove the item the slab's clock hand picks."""
+        self._remove(slab.core.victim())
+
+    def put(self, key: str, value: Any, ttl: int, stale_ttl: int, size: int) -> bool:
+        """Store a key-value pair of the given size. Caller must hold the shard lock."""
+        slab = self.slabs[bisect_left(self.slab_limits, size)]
+        if size > slab.budget:
+            slab.failures += 1  # Lets the rebalancer grow the slab until it fits
             return False
-        return time.time() > item['expires_at']
 
-    def _evict_expired(self):
-        """Remove expired items from cache."""
-        current_time = time.time()
-        expired_keys = []
+        # Calculate expiration time before changing anything; stale values are
+        # kept until the stale window after it has passed as well. Deadlines
+        # are capped below NEVER so they fit the cores' 64-bit columns
+        if ttl > 0:
+            fresh_until = min(self._now() + ttl * 1_000_000_000, NEVER - 1)
+            expires_at = min(fresh_until + stale_ttl * 1_000_000_000, NEVER - 1)
+        else:
+            fresh_until = expires_at = NEVER
+
+        # A key staying in its slab is overwritten in place, so lock-free
+        # readers see either the old or the new value; one changing size
+        # class is removed first and added back at the end
+        current = self._slab_of.get(key)
+        if current is not None and current is not slab:
+            self._remove(key)
+
+        # Check if we need to evict items, preferring the slab being written
+        while key not in self._slab_of and len(self._slab_of) >= self.max_size:
+            victim = slab if len(slab.core) else max(self.slabs, key=lambda s: len(s.core))
+            self._evict(victim)
 
-        for key, item in self._cache.items():
-            if item['ttl'] is not None and current_time > item['expires_at']:
-                expired_keys.append(key)
+        while slab.used - slab.sizes.get(key, 0) + size > slab.budget:
+            self._evict(slab)
+            slab.failures += 1
 
-        for key in expired_keys:
-            del self._cache[key]
+        slab.core.put(key, value, expires_at, fresh_until)
+        slab.used += size - slab.sizes.get(key, 0)
+        slab.sizes[key] = size
+        self._slab_of[key] = slab
 
-    def _evict_lru(self):
-        """Remove least recently used item if cache is at capacity."""
-        if len(self._cache) >= self.max_size:
-            # Remove the least recently used item (first item in OrderedDict)
-            self._cache.popitem(last=False)
+        if expires_at != NEVER:
+            heapq.heappush(self._expiry_heap, (expires_at, key))
 
-    def put(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        return True
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """Retrieve a value and whether it is fresh. Does not require the shard lock."""
+        now = self._now()
+        slab = self._slab_of.get(key)
+        value, fresh = _MISS if slab is None else slab.core.peek(key, now)
+
+        if value is None:
+            # A miss on a key that is still stored means it has expired
+            if self._is_expired(key):
+                with self.lock:
+                    if self._is_expired(key):
+                        self._remove(key)
+            return None, False
+
+        slab.hits += 1
+        return value, fresh
+
+    def delete(self, key: str) -> bool:
+        """Remove a key. Caller must hold the shard lock."""
+        if key in self._slab_of:
+            self._remove(key)
+            return True
+        return False
+
+    def clear(self):
+        """Remove all items. Caller must hold the shard lock."""
+        for slab in self.slabs:
+            slab.core.clear()
+            slab.sizes.clear()
+            slab.used = 0
+        self._slab_of.clear()
+        self._expiry_heap.clear()
+
+    def resize(self, index: int, delta: int):
+        """Grow or shrink a slab's byte budget, evicting to fit. Caller must hold the shard lock."""
+        slab = self.slabs[index]
+        slab.budget += delta
+        while slab.used > slab.budget:
+            self._evict(slab)
+
+    def _rebuild_expiry_heap(self):
+        """Rebuild the expiry heap from the live entries, dropping superseded ones."""
+        heap = []
+        for key, slab in self._slab_of.items():
+            expires_at = slab.core.expires_at(key)
+            if expires_at != NEVER:
+                heap.append((expires_at, key))
+        heapq.heapify(heap)
+        self._expiry_heap = heap
+
+    def sweep(self):
+        """Remove expired items in deadline order, visiting only those that are due."""
+        with self.lock:
+            heap = self._expiry_heap
+            now = self._now()
+
+            while heap and heap[0][0] < now:
+                expires_at, key = heapq.heappop(heap)
+                slab = self._slab_of.get(key)
+                # Skip entries for keys deleted or stored again since
+                if slab is not None and slab.core.expires_at(key) == expires_at:
+                    self._remove(key)
+
+            if len(heap) > 2 * len(self._slab_of) + self.HEAP_SLACK:
+                self._rebuild_expiry_heap()
+
+
+def _run_periodically(cache_ref: 'weakref.ref[InMemoryCache]', stopped: threading.Event,
+                      interval: float, task: Callable[['InMemoryCache'], None]):
+    """
+    Background thread body calling task(cache) every interval seconds.
+
+    Only a weak reference to the cache is held between calls, so the thread
+    doesn't keep the cache alive; it returns once stopped is set, which
+    happens when the cache is freed.
+    """
+    while not stopped.wait(interval):
+        cache = cache_ref()
+        if cache is None:
+            return
+        task(cache)
+        del cache
+
+
+class InMemoryCache:
+    """
+    A thread-safe in-memory cache with TTL and CLOCK (approximate LRU) eviction support.
+
+    Keys are spread over independently locked shards so concurrent requests
+    only contend when they touch the same shard. Within a shard, entries are
+    grouped into size-class slabs that each get a share of the byte budget.
+    """
+
+    # Maximum number of shards (must be a power of two); small caches use fewer
+    # so every shard can hold at least one entry
+    SHARD_COUNT = 16
+
+    # Upper size bound in bytes of each slab class; larger values share a final class
+    SLAB_LIMITS = (256, 4096, 65536)
+
+    # Seconds between slab budget rebalancing rounds
+    REBALANCE_SECONDS = 10
+
+    # Fraction of each shard's byte budget the final, largest slab class starts
+    # with, so a single large value can use a good share of max_bytes
+    LARGE_SLAB_SHARE = 1 / 2
+
+    # Fraction of a shard's byte budget, per slab class, moved per rebalancing round
+    REBALANCE_FRACTION = 1 / 16
+
+    # Number of threads running refresh callbacks
+    REFRESH_WORKERS = 2
+
+    # Seconds before a key whose refresh callback failed is refreshed again
+    REFRESH_RETRY_SECONDS = 5
+
+    def __init__(self, max_size: int = 1000, default_ttl: int = 3600, bucket_seconds: int = 1,
+                 default_stale_ttl: int = 0, refresh: Optional[Callable[[str], Any]] = None,
+                 max_bytes: Optional[int] = None, sizeof: Callable[[Any], int] = sys.getsizeof):
+        """
+        Initialize the cache.
+
+        Args:
+            max_size: Maximum number of items in cache (at least 1), split evenly across shards
+            default_ttl: Default time-to-live in seconds
+            bucket_seconds: Granularity of the background expiry sweep in seconds
+            default_stale_ttl: Default number of seconds a value is still served
+                after it expires, while it is refreshed in the background
+            refresh: Called in the background with a key whose value has gone
+                stale; a non-None result is stored with the default TTLs
+            max_bytes: Total byte budget, split evenly across shards; in each,
+                the large slab class starts with LARGE_SLAB_SHARE and the others
+                split the rest (None for no limit)
+            sizeof: Returns the size in bytes charged for a value
+        """
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.bucket_seconds = bucket_seconds
+        self.default_stale_ttl = default_stale_ttl
+        self.refresh = refresh
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        # Keys with a refresh in flight, each set once its refresh completes
+        self._refreshing: Dict[str, threading.Event] = {}
+        self._refresh_executor: Optional[ThreadPoolExecutor] = None
+        self._refresh_lock = threading.Lock()
+
+        # Monotonic time before which keys whose refresh failed aren't retried
+        self._refresh_retry_at: Dict[str, int] = {}
+
+        # Largest power of two up to SHARD_COUNT that leaves no shard empty
+        max_size = max(1, max_size)
+        shard_count = min(self.SHARD_COUNT, 1 << (max_size.bit_length() - 1))
+        self._shard_mask = shard_count - 1
+
+        slab_count = len(self.SLAB_LIMITS) + 1
+        if max_bytes is None:
+            slab_budgets = (NEVER,) * slab_count
+            self._rebalance_step = 1
+        else:
+            shard_budget = max(slab_count, max_bytes // shard_count)
+            large_budget = int(shard_budget * self.LARGE_SLAB_SHARE)
+            small_budget = (shard_budget - large_budget) // (slab_count - 1)
+            slab_budgets = (small_budget,) * (slab_count - 1) + (large_budget,)
+            self._rebalance_step = max(1, int(shard_budget / slab_count * self.REBALANCE_FRACTION))
+
+        # Spread the remainder over the first shards so capacities add up to max_size
+        shard_size, extra = divmod(max_size, shard_count)
+        self._shards: List[_CacheShard] = [
+            _CacheShard(shard_size + (index < extra), self.SLAB_LIMITS, slab_budgets)
+            for index in range(shard_count)
+        ]
+
+        # Set when the cache is freed, so the background threads stop
+        stopped = threading.Event()
+        weakref.finalize(self, stopped.set)
+
+        self._sweeper = threading.Thread(
+            target=_run_periodically,
+            args=(weakref.ref(self), stopped, bucket_seconds, InMemoryCache._sweep),
+            daemon=True
+        )
+        self._sweeper.start()
+
+        # Budgets only need rebalancing when they are bounded
+        if max_bytes is not None:
+            self._rebalancer = threading.Thread(
+                target=_run_periodically,
+                args=(weakref.ref(self), stopped, self.REBALANCE_SECONDS, InMemoryCache._rebalance),
+                daemon=True
+            )
+            self._rebalancer.start()
+
+    def _shard(self, key: str) -> _CacheShard:
+        """Get the shard responsible for a key."""
+        return self._shards[hash(key) & self._shard_mask]
+
+    def _sweep(self):
+        """Remove expired items from every shard."""
+        for shard in self._shards:
+            shard.sweep()
+
+    def _rebalance(self):
+        """
+        Move byte budget to the slab class with the most allocation failures
+        (evictions to make room and values too large to fit) since the last
+        round, from the class with the fewest hits per byte.
+        """
+        slab_count = len(self.SLAB_LIMITS) + 1
+        hits = [0] * slab_count
+        failures = [0] * slab_count
+
+        for shard in self._shards:
+            with shard.lock:
+                for index, slab in enumerate(shard.slabs):
+                    hits[index] += slab.hits
+                    failures[index] += slab.failures
+                    slab.hits = slab.failures = 0
+
+        receiver = max(range(slab_count), key=failures.__getitem__)
+        if failures[receiver] == 0:
+            return
+
+        # Budgets move in lockstep across shards, so any shard's are representative
+        budgets = [slab.budget for slab in self._shards[0].slabs]
+        donors = [
+            index for index in range(slab_count)
+            if index != receiver and budgets[index] > self._rebalance_step
+        ]
+        if not donors:
+            return
+        donor = min(donors, key=lambda index: hits[index] / budgets[index])
+
+        for shard in self._shards:
+            with shard.lock:
+                shard.resize(donor, -self._rebalance_step)
+                shard.resize(receiver, self._rebalance_step)
+
+    def _schedule_refresh(self, key: str):
+        """
+        Run the refresh callback for a stale key, at most once at a time per
+        key and not again until REFRESH_RETRY_SECONDS after a failure.
+        """
+        retry_at = self._refresh_retry_at.get(key)
+        if retry_at is not None:
+            if time.monotonic_ns() < retry_at:
+                return  # Backing off after a failed refresh
+            self._refresh_retry_at.pop(key, None)
+
+        done = threading.Event()
+        if self._refreshing.setdefault(key, done) is not done:
+            return  # Already being refreshed
+
+        if self._refresh_executor is None:
+            with self._refresh_lock:
+                if self._refresh_executor is None:
+                    self._refresh_executor = ThreadPoolExecutor(max_workers=self.REFRESH_WORKERS)
+
+        self._refresh_executor.submit(self._run_refresh, key, done)
+
+    def _run_refresh(self, key: str, done: threading.Event):
+        """Fetch a new value for a stale key and store it."""
+        try:
+            value = self.refresh(key)
+            if value is not None:
+                self.put(key, value)
+        except Exception:
+            logger.exception('Refreshing cache key %r failed; retrying in %s seconds',
+                             key, self.REFRESH_RETRY_SECONDS)
+            self._refresh_retry_at[key] = time.monotonic_ns() + self.REFRESH_RETRY_SECONDS * 1_000_000_000
+        finally:
+            del self._refreshing[key]
+            done.set()
+
+    def put(self, key: str, value: Any, ttl: Optional[int] = None, stale_ttl: Optional[int] = None) -> bool:
         """
         Store a key-value pair in the cache.
 
@@ -56,37 +580,43 @@ class InMemoryCache:
             key: Cache key
             value: Value to store
             ttl: Time-to-live in seconds (None for no expiration)
+            stale_ttl: Seconds the value is still served as stale after it expires
 
         Returns:
-            True if successfully stored
+            True if successfully stored, False if the value is larger than the
+            budget of its slab
         """
-        with self._lock:
-            # Use default TTL if not specified
-            if ttl is None:
-                ttl = self.default_ttl
+        # Use default TTLs if not specified
+        if ttl is None:
+            ttl = self.default_ttl
+        if stale_ttl is None:
+            stale_ttl = self.default_stale_ttl
+
+        size = self.sizeof(value)
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.put(key, value, ttl, stale_ttl, size)
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """
+        Retrieve a value from the cache along with its freshness.
+
+        A stale value (expired but still inside its stale window) is returned
+        immediately and, if a refresh callback is configured, refreshed in the
+        background.
 
-            # Calculate expiration time
-            expires_at = time.time() + ttl if ttl > 0 else None
+        Args:
+            key: Cache key
 
-            # Remove expired items
-            self._evict_expired()
+        Returns:
+            (value, fresh) if found, (None, False) otherwise
+        """
+        value, fresh = self._shard(key).lookup(key)
 
-            # If key already exists, remove it (we'll add it back at the end)
-            if key in self._cache:
-                del self._cache[key]
-            else:
-                # Check if we need to evict LRU item
-                self._evict_lru()
-
-            # Add new item
-            self._cache[key] = {
-                'value': value,
-                'ttl': ttl if ttl > 0 else None,
-                'expires_at': expires_at,
-                'created_at': time.time()
-            }
+        if value is not None and not fresh and self.refresh is not None:
+            self._schedule_refresh(key)
 
-            return True
+        return value, fresh
 
     def get(self, key: str) -> Optional[Any]:
         """
@@ -96,23 +626,9 @@ class InMemoryCache:
             key: Cache key
 
         Returns:
-            Value if found and not expired, None otherwise
+            Value if found and not past its stale window, None otherwise
         """
-        with self._lock:
-            if key not in self._cache:
-                return None
-
-            item = self._cache[key]
-
-            # Check if expired
-            if self._is_expired(item):
-                del self._cache[key]
-                return None
-
-            # Move to end (mark as recently used)
-            self._cache.move_to_end(key)
-
-            return item['value']
+        return self.lookup(key)[0]
 
     def delete(self, key: str) -> bool:
         """
@@ -124,37 +640,229 @@ class InMemoryCache:
         Returns:
             True if key was found and removed, False otherwise
         """
-        with self._lock:
-            if key in self._cache:
-                del self._cache[key]
-                return True
-            return False
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.delete(key)
 
     def clear(self):
         """Clear all items from the cache."""
-        with self._lock:
-            self._cache.clear()
+        for shard in self._shards:
+            with shard.lock:
+                shard.clear()
 
     def size(self) -> int:
         """Get the current number of items in cache."""
-        with self._lock:
-            self._evict_expired()
-            return len(self._cache)
+        total = 0
+        for shard in self._shards:
+            with shard.lock:
+                total += len(shard)
+        return total
 
     def stats(self) -> Dict:
         """Get cache statistics."""
-        with self._lock:
-            self._evict_expired()
-            return {
-                'size': len(self._cache),
-                'max_size': self.max_size,
-                'default_ttl': self.default_ttl
-            }
+        names = [str(limit) for limit in self.SLAB_LIMITS] + ['large']
+        slabs = {name: {'items': 0, 'bytes': 0, 'budget': 0} for name in names}
+
+        for shard in self._shards:
+            with shard.lock:
+                for name, slab in zip(names, shard.slabs):
+                    slabs[name]['items'] += len(slab.core)
+                    slabs[name]['bytes'] += slab.used
+                    slabs[name]['budget'] += slab.budget
+
+        if self.max_bytes is None:
+            for slab_stats in slabs.values():
+                slab_stats['budget'] = None
+
+        return {
+            'size': sum(slab_stats['items'] for slab_stats in slabs.values()),
+            'max_size': sum(shard.max_size for shard in self._shards),
+            'max_bytes': self.max_bytes,
+            'default_ttl': self.default_ttl,
+            'default_stale_ttl': self.default_stale_ttl,
+            'shards': len(self._shards),
+            'slabs': slabs
+        }
+
+
+# Second, ISO 8601 string and its encoded bytes of the last timestamp formatted
+_iso_cache = (0, '', b'')
+
+
+def _refresh_iso() -> Tuple[int, str, bytes]:
+    """Return the cached timestamp, reformatting it once the second has changed."""
+    global _iso_cache
+    now = int(time.time())
+    cached = _iso_cache
+    if cached[0] != now:
+        iso = datetime.fromtimestamp(now).isoformat()
+        cached = _iso_cache = (now, iso, iso.encode())
+    return cached
+
 
+def _iso() -> str:
+    """Current local time as an ISO 8601 string, to the second."""
+    return _refresh_iso()[1]
+
+
+def _iso_bytes() -> bytes:
+    """Current local time as ISO 8601 bytes, to the second."""
+    return _refresh_iso()[2]
+
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize obj to compact JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # e.g. integers wider than 64 bits; fall back to the stdlib
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes with orjson, deferring to the stdlib for
+    what orjson rejects.
+
+    Parsing stays with the stdlib: orjson reads integers wider than 64 bits
+    as floats instead of rejecting them, which would silently change values.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+
+class CachedResponse(NamedTuple):
+    """A value stored through the API together with its serialized JSON body."""
+    value: Any
+    # Response body up to (not including) the closing brace, so per-request
+    # fields can be appended without re-encoding the value
+    body: bytes
+    etag: str
+    # Wall-clock time the value stops being fresh (math.inf if it never does)
+    fresh_until: float
+    # Content-Type header, parameters included, of a raw body stored and
+    # served verbatim; None for the JSON envelope
+    content_type: Optional[str] = None
+
+
+# Longest Content-Type accepted for a raw body, in encoded bytes (the
+# largest length UwsgiCache can store ahead of a body)
+MAX_CONTENT_TYPE_BYTES = 0xFFFF
+
+
+def _cache_headers(response: Response, item: CachedResponse) -> Response:
+    """Set the HTTP caching headers that let clients and proxies reuse a cached value."""
+    if item.fresh_until == math.inf:
+        # Never expires but can be replaced or deleted at any time, so clients
+        # keep it but check the ETag before each reuse
+        response.headers['Cache-Control'] = 'no-cache'
+    else:
+        max_age = max(0, int(item.fresh_until - time.time()))
+        response.headers['Cache-Control'] = f'max-age={max_age}'
+    response.headers['Vary'] = 'Accept'
+    # Weak: the body also carries the per-request "fresh" and "timestamp" fields
+    response.set_etag(item.etag, weak=True)
+    return response
+
+
+class UwsgiCache:
+    """
+    Stores API responses in a uWSGI cache2 region instead of process memory.
+
+    The region lives in shared memory, so every uWSGI worker process sees
+    the same entries. Only the serialized response is kept; the `value` of
+    items returned by lookup is None.
+    """
+
+    # Packed ahead of each body: ETag, the wall-clock time it stops being
+    # fresh and the length of the raw content type that follows (0 for JSON)
+    _HEADER = struct.Struct('!16sdH')
+
+    def __init__(self, name: str, default_ttl: int = 3600, default_stale_ttl: int = 0):
+        """
+        Initialize the adapter.
+
+        Args:
+            name: Name of the cache2 region configured in uWSGI
+            default_ttl: Default time-to-live in seconds
+            default_stale_ttl: Default number of seconds a value is still served after it expires
+        """
+        self.name = name
+        self.default_ttl = default_ttl
+        self.default_stale_ttl = default_stale_ttl
+
+    def put(self, key: str, item: CachedResponse, ttl: Optional[int] = None, stale_ttl: Optional[int] = None) -> bool:
+        """Store a response; False if it does not fit in the region."""
+        if ttl is None:
+            ttl = self.default_ttl
+        if stale_ttl is None:
+            stale_ttl = self.default_stale_ttl
+
+        expires = ttl + stale_ttl if ttl > 0 else 0  # 0 never expires
+        content_type = (item.content_type or '').encode()
+        data = b''.join((
+            self._HEADER.pack(item.etag.encode(), item.fresh_until, len(content_type)),
+            content_type,
+            item.body
+        ))
+        return bool(uwsgi.cache_update(key, data, expires, self.name))
+
+    def lookup(self, key: str) -> Tuple[Optional[CachedResponse], bool]:
+        """Retrieve a response along with its freshness."""
+        data = uwsgi.cache_get(key, self.name)
+        if data is None:
+            return None, False
+
+        etag, fresh_until, content_type_length = self._HEADER.unpack_from(data)
+        body_start = self._HEADER.size + content_type_length
+        content_type = data[self._HEADER.size:body_start].decode() or None
+        item = CachedResponse(None, data[body_start:], etag.decode(), fresh_until, content_type)
+        return item, time.time() <= fresh_until
+
+    def delete(self, key: str) -> bool:
+        """Remove a key; False if it was not found."""
+        if uwsgi.cache_exists(key, self.name):
+            uwsgi.cache_del(key, self.name)
+            return True
+        return False
+
+    def clear(self):
+        """Clear all items from the region."""
+        uwsgi.cache_clear(self.name)
+
+    def stats(self) -> Dict:
+        """Get cache statistics."""
+        return {
+            'backend': 'uwsgi',
+            'cache': self.name,
+            'default_ttl': self.default_ttl,
+            'default_stale_ttl': self.default_stale_ttl
+        }
+
+
+# Name of the uWSGI cache2 region shared by worker processes (see uwsgi.ini)
+UWSGI_CACHE_NAME = 'api'
 
 # Initialize Flask app and cache
 app = Flask(__name__)
-cache = InMemoryCache(max_size=1000, default_ttl=3600)  # 1 hour default TTL
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+if uwsgi is not None and 'cache2' in uwsgi.opt:
+    # Share one cache between all uWSGI worker processes
+    cache = UwsgiCache(UWSGI_CACHE_NAME, default_ttl=3600)
+else:
+    cache = InMemoryCache(
+        max_size=1000,
+        default_ttl=3600,  # 1 hour default TTL
+        max_bytes=256 * 1024 * 1024,  # 256 MiB of serialized values
+        sizeof=lambda item: len(item.body)
+    )
 
 
 @app.route('/cache/<key>', methods=['GET'])
@@ -166,19 +874,34 @@ def get_cache_item(key):
         JSON response with value or error message
     """
     try:
-        value = cache.get(key)
+        item, fresh = cache.lookup(key)
 
-        if value is None:
+        if item is None:
             return jsonify({
                 'error': 'Key not found or expired',
                 'key': key
             }), 404
 
-        return jsonify({
-            'key': key,
-            'value': value,
-            'timestamp': datetime.now().isoformat()
-        }), 200
+        # The client already has this value
+        if request.if_none_match.contains_weak(item.etag):
+            return _cache_headers(Response(status=304), item)
+
+        # Raw bodies are passed through exactly as they were stored. Their
+        # content type comes from the client, so browsers are told not to
+        # sniff or render them (e.g. text/html) as part of this origin
+        if item.content_type is not None:
+            response = Response(item.body, status=200, content_type=item.content_type)
+            response.headers['X-Content-Type-Options'] = 'nosniff'
+            response.headers['Content-Disposition'] = 'attachment'
+            return _cache_headers(response, item)
+
+        # Only the per-request fields are serialized; the value was encoded on PUT
+        body = b''.join((
+            item.body,
+            b',"fresh":', b'true' if fresh else b'false',
+            b',"timestamp":"', _iso_bytes(), b'"}'
+        ))
+        return _cache_headers(Response(body, status=200, mimetype='application/json'), item)
 
     except Exception as e:
         return jsonify({
@@ -186,6 +909,30 @@ def get_cache_item(key):
         }), 500
 
 
+def _reject_constant(name: str):
+    """Refuse NaN and Infinity, which can't be sent back as JSON."""
+    raise ValueError(f'{name} is not a valid JSON value')
+
+
+def _finite_float(text: str) -> float:
+    """Parse a JSON number, refusing ones too large for a float rather than reading them as Infinity."""
+    value = float(text)
+    if not math.isfinite(value):
+        raise ValueError(f'{text} is out of range')
+    return value
+
+
+def _query_int(name: str) -> Any:
+    """Read an integer query parameter, leaving malformed values as strings for validation to reject."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
 @app.route('/cache/<key>', methods=['PUT'])
 def put_cache_item(key):
     """
@@ -194,27 +941,48 @@ def put_cache_item(key):
     Expected JSON body:
     {
         "value": "any_value",
-        "ttl": 3600  // optional, time-to-live in seconds
+        "ttl": 3600,  // optional, time-to-live in seconds
+        "stale_ttl": 60  // optional, seconds a value is served stale after expiring
     }
 
+    A body sent as application/msgpack, or any body with ?raw=1, is stored
+    as-is and served back verbatim with its content type, as an attachment
+    browsers won't render; ttl and stale_ttl are then read from the query
+    string.
+
     Returns:
         JSON response with success message or error
     """
     try:
-        if not request.is_json:
-            return jsonify({
-                'error': 'Content-Type must be application/json'
-            }), 400
+        raw = request.mimetype == 'application/msgpack' or request.args.get('raw') == '1'
+
+        if raw:
+            value = request.get_data()
+            ttl = _query_int('ttl')
+            stale_ttl = _query_int('stale_ttl')
+        else:
+            if not request.is_json:
+                return jsonify({
+                    'error': 'Content-Type must be application/json or application/msgpack (or use ?raw=1)'
+                }), 400
 
-        data = request.get_json()
+            # Values are encoded again on the way out, so anything JSON can't
+            # represent is refused here instead of coming back changed
+            try:
+                data = json.loads(request.get_data(), parse_constant=_reject_constant, parse_float=_finite_float)
+            except ValueError as e:
+                return jsonify({
+                    'error': f'Invalid JSON body: {e}'
+                }), 400
 
-        if 'value' not in data:
-            return jsonify({
-                'error': 'Missing required field: value'
-            }), 400
+            if 'value' not in data:
+                return jsonify({
+                    'error': 'Missing required field: value'
+                }), 400
 
-        value = data['value']
-        ttl = data.get('ttl', None)  # Use cache default if not specified
+            value = data['value']
+            ttl = data.get('ttl', None)  # Use cache default if not specified
+            stale_ttl = data.get('stale_ttl', None)
 
         # Validate TTL if provided
         if ttl is not None:
@@ -223,20 +991,45 @@ def put_cache_item(key):
                     'error': 'TTL must be a non-negative integer'
                 }), 400
 
-        success = cache.put(key, value, ttl)
+        # Validate stale TTL if provided
+        if stale_ttl is not None:
+            if not isinstance(stale_ttl, int) or stale_ttl < 0:
+                return jsonify({
+                    'error': 'stale_ttl must be a non-negative integer'
+                }), 400
+
+        effective_ttl = cache.default_ttl if ttl is None else ttl
+        fresh_until = time.time() + effective_ttl if effective_ttl > 0 else math.inf
+
+        if raw:
+            body = value
+            content_type = request.content_type or 'application/octet-stream'
+            if len(content_type.encode()) > MAX_CONTENT_TYPE_BYTES:
+                return jsonify({
+                    'error': f'Content-Type must be at most {MAX_CONTENT_TYPE_BYTES} bytes'
+                }), 400
+        else:
+            body = _dumps({'key': key, 'value': value})[:-1]
+            content_type = None
+
+        etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        item = CachedResponse(value, body, etag, fresh_until, content_type)
+        success = cache.put(key, item, ttl, stale_ttl)
 
         if success:
             response_data = {
                 'message': 'Value stored successfully',
                 'key': key,
                 'ttl': ttl or cache.default_ttl,
-                'timestamp': datetime.now().isoformat()
+                'stale_ttl': cache.default_stale_ttl if stale_ttl is None else stale_ttl,
+                'timestamp': _iso()
             }
-            return jsonify(response_data), 201
+            return _cache_headers(jsonify(response_data), item), 201
         else:
             return jsonify({
-                'error': 'Failed to store value'
-            }), 500
+                'error': 'Value too large to cache',
+                'key': key
+            }), 413
 
     except Exception as e:
         return jsonify({
@@ -254,7 +1047,7 @@ def delete_cache_item(key):
             return jsonify({
                 'message': 'Key deleted successfully',
                 'key': key,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': _iso()
             }), 200
         else:
             return jsonify({
@@ -273,7 +1066,7 @@ def get_cache_stats():
     """GET endpoint to retrieve cache statistics."""
     try:
         stats = cache.stats()
-        stats['timestamp'] = datetime.now().isoformat()
+        stats['timestamp'] = _iso()
         return jsonify(stats), 200
 
     except Exception as e:
@@ -289,7 +1082,7 @@ def clear_cache():
         cache.clear()
         return jsonify({
             'message': 'Cache cleared successfully',
-            'timestamp': datetime.now().isoformat()
+            'timestamp': _iso()
         }), 200
 
     except Exception as e:
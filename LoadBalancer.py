@@ -1,7 +1,7 @@
-import http.server
-import socketserver
-import threading
-import requests
+import itertools
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
 
 # List of backend servers
 BACKENDS = [
@@ -10,32 +10,85 @@ BACKENDS = [
     "http://localhost:8003"
 ]
 
-current = 0  # Index of the next server to forward to
-lock = threading.Lock()  # Thread-safe counter
-
-class LoadBalancerHandler(http.server.BaseHTTPRequestHandler):
-    def do_GET(self):
-        global current
-        with lock:
-            backend = BACKENDS[current]
-            current = (current + 1) % len(BACKENDS)
-
-        try:
-            # Forward the request to the chosen backend
-            response = requests.get(backend + self.path)
-            self.send_response(response.status_code)
-            for header, value in response.headers.items():
-                if header.lower() != 'content-encoding':
-                    self.send_header(header, value)
-            self.end_headers()
-            self.wfile.write(response.content)
-        except requests.exceptions.RequestException as e:
-            self.send_response(502)
-            self.end_headers()
-            self.wfile.write(f"Bad Gateway: {e}".encode())
+# Size of the buffer used to relay response bodies
+CHUNK_SIZE = 64 * 1024
+
+# Headers that describe a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade"
+}
+
+# Returns the next server to forward to in round-robin order. A single
+# C-level call, so it needs no lock even if handlers run on several threads
+next_backend = itertools.cycle(BACKENDS).__next__
+
+# Shared session so backend connections are pooled and reused across requests,
+# created once the event loop is running
+session = None
+
+
+def forward_headers(headers, drop=()):
+    """
+    Copy headers, keeping repeated ones such as Set-Cookie, leaving out
+    hop-by-hop headers, those named in Connection and any listed in drop.
+    """
+    excluded = HOP_BY_HOP_HEADERS.union(drop)
+    for value in headers.getall("Connection", ()):
+        excluded.update(token.strip().lower() for token in value.split(","))
+
+    return CIMultiDict(
+        (header, value) for header, value in headers.items()
+        if header.lower() not in excluded
+    )
+
+
+async def handle(request):
+    backend = next_backend()
+
+    try:
+        # Forward the request to the chosen backend
+        upstream = await session.request(
+            request.method,
+            backend + request.path_qs,
+            headers=forward_headers(request.headers, drop={"host"}),
+            data=request.content if request.body_exists else None,
+            allow_redirects=False
+        )
+    except aiohttp.ClientError as e:
+        return web.Response(status=502, text=f"Bad Gateway: {e}")
+
+    async with upstream:
+        # Content-Length is passed through when the backend sent one;
+        # otherwise aiohttp chunks the response to the client
+        response = web.StreamResponse(status=upstream.status, headers=forward_headers(upstream.headers))
+        await response.prepare(request)
+        # Relay the raw (still encoded) body without buffering it
+        async for chunk in upstream.content.iter_chunked(CHUNK_SIZE):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+
+async def client_session(app):
+    global session
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=200, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(sock_connect=1, sock_read=30),
+        auto_decompress=False
+    )
+    yield
+    await session.close()
+
+
+def create_app():
+    app = web.Application()
+    app.cleanup_ctx.append(client_session)
+    app.router.add_route("*", "/{tail:.*}", handle)
+    return app
+
 
 if __name__ == "__main__":
     PORT = 8080
-    with socketserver.ThreadingTCPServer(("", PORT), LoadBalancerHandler) as httpd:
-        print(f"Load balancer running on port {PORT}...")
-        httpd.serve_forever()
+    print(f"Load balancer running on port {PORT}...")
+    web.run_app(create_app(), port=PORT, print=None)
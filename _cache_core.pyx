@@ -0,0 +1,161 @@
+# cython: language_level=3
+"""
+Compiled storage core for InMemoryCache shards.
+
+Build in place with ``cythonize -i _cache_core.pyx``. InMemoryCache falls
+back to its pure-Python core when the extension is not available.
+"""
+
+import sys
+
+# Expiration time of entries that never expire (monotonic nanoseconds)
+cdef long long NEVER = sys.maxsize
+
+# (value, fresh) returned by peek for a missing or expired key
+cdef tuple MISS = (None, False)
+
+
+cdef class _Node:
+    cdef object key
+    cdef object value
+    cdef long long expires_at
+    cdef long long fresh_until
+    cdef unsigned char referenced
+    cdef Py_ssize_t slot
+    cdef _Node next  # Free list link
+
+
+cdef class CacheCore:
+    """
+    Hash map of nodes placed in the slots of a ring, evicted with CLOCK
+    (second chance).
+
+    Reads only set a node's reference bit; the clock hand sweeps the ring
+    clearing bits until it reaches an unreferenced node.
+
+    Nodes for max_size entries are preallocated on a free list (linked
+    through ``next``) and recycled on removal, so steady-state writes
+    don't allocate.
+    """
+
+    cdef dict _nodes
+    cdef list _ring
+    cdef list _holes
+    cdef Py_ssize_t _hand
+    cdef _Node _free
+
+    def __cinit__(self, Py_ssize_t max_size=0):
+        cdef Py_ssize_t i
+        self._nodes = {}
+        self._ring = []
+        self._holes = []
+        self._hand = 0
+        self._free = None
+        for i in range(max_size):
+            self._release(_Node())
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, key):
+        return key in self._nodes
+
+    cdef inline _Node _acquire(self):
+        cdef _Node node = self._free
+        if node is None:
+            return _Node()
+        self._free = node.next
+        node.next = None
+        return node
+
+    cdef inline void _release(self, _Node node):
+        node.key = None
+        node.value = None
+        node.referenced = 0
+        node.next = self._free
+        self._free = node
+
+    def peek(self, key, long long now):
+        """
+        Return (value, fresh) for key and mark it referenced, or (None, False)
+        if missing or expired.
+        """
+        cdef _Node node = self._nodes.get(key)
+        if node is None or now > node.expires_at:
+            return MISS
+        node.referenced = 1
+        return node.value, now <= node.fresh_until
+
+    def put(self, key, value, long long expires_at, long long fresh_until):
+        """
+        Store value, replacing any existing entry (expires_at NEVER for no
+        expiration). Between fresh_until and expires_at the value is stale.
+        """
+        cdef _Node node = self._nodes.get(key)
+        if node is None:
+            node = self._acquire()
+            node.key = key
+            if self._holes:
+                node.slot = self._holes.pop()
+                self._ring[node.slot] = node
+            else:
+                node.slot = len(self._ring)
+                self._ring.append(node)
+            self._nodes[key] = node
+
+        node.value = value
+        node.expires_at = expires_at
+        node.fresh_until = fresh_until
+
+    def pop(self, key):
+        """Remove key and return its expiration time."""
+        cdef _Node node = self._nodes.pop(key)
+        cdef long long expires_at = node.expires_at
+        self._ring[node.slot] = None
+        self._holes.append(node.slot)
+        self._release(node)
+        return expires_at
+
+    def victim(self):
+        """Advance the clock hand to an unreferenced entry and return its key."""
+        cdef Py_ssize_t hand = self._hand
+        cdef object slot
+        cdef _Node node
+
+        if not self._nodes:
+            raise KeyError('victim(): cache core is empty')
+
+        while True:
+            if hand >= len(self._ring):
+                hand = 0
+            slot = self._ring[hand]
+            if slot is not None:
+                node = <_Node>slot
+                if not node.referenced:
+                    self._hand = hand + 1
+                    return node.key
+                node.referenced = 0  # Second chance
+            hand += 1
+
+    def expires_at(self, key):
+        """Return the expiration time of key (NEVER if missing or it never expires)."""
+        cdef _Node node = self._nodes.get(key)
+        if node is None:
+            return NEVER
+        return node.expires_at
+
+    def fresh_until(self, key):
+        """Return the time key stops being fresh (NEVER if missing or it never expires)."""
+        cdef _Node node = self._nodes.get(key)
+        if node is None:
+            return NEVER
+        return node.fresh_until
+
+    def clear(self):
+        """Remove all entries."""
+        cdef _Node node
+        for node in self._nodes.values():
+            self._ring[node.slot] = None
+            self._holes.append(node.slot)
+            self._release(node)
+        self._nodes.clear()
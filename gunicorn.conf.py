@@ -0,0 +1,11 @@
+# Gunicorn settings for the cache API: gunicorn -c gunicorn.conf.py InMemoryCache:app
+#
+# The cache lives in the worker's memory, so a single worker serves every
+# request and concurrency comes from threads, which the sharded locks and
+# lock-free reads let run side by side. To scale across processes, run under
+# uWSGI with uwsgi.ini, which shares one cache region between workers.
+
+bind = '0.0.0.0:8080'
+workers = 1
+worker_class = 'gthread'
+threads = 8
@@ -0,0 +1,423 @@
+import gc
+import sys
+import threading
+import time
+import unittest
+import weakref
+from unittest import mock
+
+from InMemoryCache import NEVER, CacheCore, InMemoryCache, _CacheCore, _CacheShard, app
+
+# Arbitrary monotonic times, in nanoseconds, used with the cores directly
+NOW = 1_000_000_000
+LATER = 2_000_000_000
+
+
+def _clock_after(seconds):
+    """Patch the shards' clock to read the given number of seconds from now."""
+    now = time.monotonic_ns() + int(seconds * 1_000_000_000)
+    return mock.patch.object(_CacheShard, '_now', return_value=now)
+
+
+def _wait_for_refreshes(cache):
+    """Wait until no background refresh of the cache is in flight."""
+    deadline = time.monotonic() + 5
+    while cache._refreshing and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+class _HookedList(list):
+    """A list that runs a callback the first time an item is read from it."""
+
+    def __init__(self, items, hook):
+        super().__init__(items)
+        self.hook = hook
+
+    def __getitem__(self, index):
+        hook, self.hook = self.hook, None
+        if hook is not None:
+            hook()
+        return super().__getitem__(index)
+
+
+class CacheCoreTest(unittest.TestCase):
+    core_class = CacheCore
+
+    def test_peek_reports_freshness(self):
+        core = self.core_class(4)
+        core.put('a', 'value', LATER, NOW)
+        self.assertEqual(core.peek('a', NOW), ('value', True))
+        self.assertEqual(core.peek('a', NOW + 1), ('value', False))
+        self.assertEqual(core.peek('a', LATER + 1), (None, False))
+        self.assertEqual(core.peek('missing', NOW), (None, False))
+
+    def test_clock_spares_referenced_entries(self):
+        core = self.core_class(3)
+        for key in 'abc':
+            core.put(key, key, NEVER, NEVER)
+
+        core.peek('a', NOW)
+        self.assertEqual(core.victim(), 'b')
+        core.pop('b')
+        self.assertEqual(core.victim(), 'c')
+        core.pop('c')
+        # a lost its reference bit on the first sweep
+        self.assertEqual(core.victim(), 'a')
+
+    def test_slots_are_reused(self):
+        core = self.core_class(2)
+        core.put('a', 1, NEVER, NEVER)
+        self.assertEqual(core.pop('a'), NEVER)
+        core.put('b', 2, NOW, NOW)
+        self.assertEqual(len(core), 1)
+        self.assertNotIn('a', core)
+        self.assertEqual(core.expires_at('b'), NOW)
+
+
+class PurePythonCoreTest(CacheCoreTest):
+    core_class = _CacheCore
+
+    def test_peek_rereads_a_slot_rewritten_under_it(self):
+        core = _CacheCore(4)
+        core.put('a', 'a1', NEVER, NEVER)
+
+        # The slot is handed to another key and back again between the
+        # reader's first and second read of its sequence number
+        def reuse_for_b():
+            core.pop('a')
+            core.put('b', 'b1', NEVER, NEVER)
+
+        def reuse_for_a():
+            core.pop('b')
+            core.put('a', 'a2', NEVER, NEVER)
+
+        core._values = _HookedList(core._values, reuse_for_b)
+        core._fresh = _HookedList(core._fresh, reuse_for_a)
+        self.assertEqual(core.peek('a', NOW), ('a2', True))
+
+
+class ShardingTest(unittest.TestCase):
+    def test_keys_spread_over_shards(self):
+        cache = InMemoryCache(max_size=1600, default_ttl=0)
+        for index in range(800):
+            cache.put(f'k{index}', index)
+
+        self.assertEqual(cache.size(), 800)
+        self.assertTrue(all(len(shard) for shard in cache._shards))
+        self.assertEqual(cache.get('k123'), 123)
+
+    def test_small_cache_holds_max_size_items(self):
+        for max_size in (1, 3, 16, 17):
+            cache = InMemoryCache(max_size=max_size, default_ttl=0)
+            for index in range(50):
+                cache.put(f'k{index}', index)
+
+            stats = cache.stats()
+            self.assertLessEqual(cache.size(), max_size)
+            self.assertEqual(stats['max_size'], max_size)
+            self.assertLessEqual(stats['shards'], max_size)
+
+    def test_concurrent_writers(self):
+        cache = InMemoryCache(max_size=1600, default_ttl=0)
+
+        def write(prefix):
+            for index in range(200):
+                cache.put(f'{prefix}{index}', index)
+
+        writers = [threading.Thread(target=write, args=(prefix,)) for prefix in 'abcd']
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+        self.assertEqual(cache.size(), 800)
+        self.assertEqual(cache.get('c199'), 199)
+
+
+class LockFreeReadTest(unittest.TestCase):
+    def setUp(self):
+        # Switch threads as often as possible so reads land inside writes
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+
+    def test_overwrite_never_hides_the_key(self):
+        cache = InMemoryCache(max_size=16, default_ttl=0)
+        cache.put('k', 'v0')
+        stop = threading.Event()
+
+        def overwrite():
+            version = 0
+            while not stop.is_set():
+                version += 1
+                cache.put('k', f'v{version}')
+
+        writer = threading.Thread(target=overwrite)
+        writer.start()
+        try:
+            misses = 0
+            deadline = time.monotonic() + 0.5
+            while time.monotonic() < deadline:
+                if cache.get('k') is None:
+                    misses += 1
+        finally:
+            stop.set()
+            writer.join()
+
+        self.assertEqual(misses, 0)
+
+    def test_overwrite_moving_size_class_updates_accounting(self):
+        cache = InMemoryCache(max_size=16, default_ttl=0, sizeof=len)
+        cache.put('k', 'x' * 10)
+        cache.put('k', 'x' * 20)
+        cache.put('k', 'x' * 1000)
+
+        slabs = cache.stats()['slabs']
+        self.assertEqual(slabs['256'], {'items': 0, 'bytes': 0, 'budget': None})
+        self.assertEqual(slabs['4096'], {'items': 1, 'bytes': 1000, 'budget': None})
+        self.assertEqual(cache.get('k'), 'x' * 1000)
+
+
+class ExpiryTest(unittest.TestCase):
+    def test_expired_item_is_removed_on_read(self):
+        cache = InMemoryCache(max_size=16, bucket_seconds=3600)
+        cache.put('k', 'v', ttl=1)
+        self.assertEqual(cache.get('k'), 'v')
+
+        with _clock_after(2):
+            self.assertIsNone(cache.get('k'))
+        self.assertEqual(cache.size(), 0)
+
+    def test_background_threads_do_not_keep_cache_alive(self):
+        cache = InMemoryCache(max_bytes=1024)
+        threads = [cache._sweeper, cache._rebalancer]
+        ref = weakref.ref(cache)
+        del cache
+
+        deadline = time.monotonic() + 1
+        while ref() is not None and time.monotonic() < deadline:
+            gc.collect()
+        self.assertIsNone(ref())
+
+        for thread in threads:
+            thread.join(timeout=1)
+            self.assertFalse(thread.is_alive())
+
+    def test_sweep_removes_only_due_items(self):
+        cache = InMemoryCache(max_size=1600, bucket_seconds=3600)
+        cache.put('short', 1, ttl=1)
+        cache.put('long', 2, ttl=100)
+        cache.put('forever', 3, ttl=0)
+
+        with _clock_after(2):
+            cache._sweep()
+        self.assertEqual(cache.size(), 2)
+        self.assertEqual(cache.get('long'), 2)
+        self.assertEqual(cache.get('forever'), 3)
+
+    def test_sweep_skips_superseded_deadlines(self):
+        cache = InMemoryCache(max_size=1600, bucket_seconds=3600)
+        cache.put('k', 'old', ttl=1)
+        cache.put('k', 'new', ttl=100)
+        cache.put('gone', 'x', ttl=1)
+        cache.delete('gone')
+
+        with _clock_after(2):
+            cache._sweep()
+        self.assertEqual(cache.get('k'), 'new')
+
+    def test_expiry_heap_is_rebuilt(self):
+        cache = InMemoryCache(max_size=1, bucket_seconds=3600)
+        shard, = cache._shards
+        for _ in range(200):
+            cache.put('k', 'v', ttl=100)
+        self.assertEqual(len(shard._expiry_heap), 200)
+
+        cache._sweep()
+        self.assertEqual(len(shard._expiry_heap), 1)
+        self.assertEqual(cache.get('k'), 'v')
+
+    def test_huge_ttl_is_capped(self):
+        cache = InMemoryCache(max_size=16)
+        cache.put('k', 'old')
+        self.assertTrue(cache.put('k', 'new', ttl=10_000_000_000, stale_ttl=10 ** 30))
+        self.assertEqual(cache.lookup('k'), ('new', True))
+
+        # The slot was left consistent, so later writes and evictions work
+        for index in range(32):
+            cache.put(f'other{index}', index)
+        self.assertLessEqual(cache.size(), 16)
+        self.assertEqual(cache.get('other31'), 31)
+
+
+class SlabTest(unittest.TestCase):
+    def test_large_values_do_not_push_out_small_ones(self):
+        cache = InMemoryCache(max_size=1600, default_ttl=0, max_bytes=16 * 64 * 1024, sizeof=len)
+        for index in range(100):
+            cache.put(f'small{index}', 'x' * 100)
+        for index in range(200):
+            cache.put(f'large{index}', 'x' * 20_000)
+
+        self.assertEqual(cache.stats()['slabs']['256']['items'], 100)
+        self.assertIsNotNone(cache.get('small0'))
+
+    def test_large_class_gets_a_large_share(self):
+        cache = InMemoryCache(max_bytes=256 * 1024 * 1024, sizeof=len)
+        self.assertTrue(cache.put('big', 'x' * (5 * 1024 * 1024)))
+
+    def test_rejected_values_grow_their_class(self):
+        cache = InMemoryCache(max_size=16, default_ttl=0, max_bytes=16 * 256 * 1024, sizeof=len)
+        value = 'x' * (130 * 1024)
+        self.assertFalse(cache.put('big', value))
+
+        for _ in range(10):
+            cache._rebalance()
+            if cache.put('big', value):
+                break
+        self.assertEqual(cache.get('big'), value)
+
+        # Budget moves between classes, never out of the cache
+        budgets = [slab['budget'] for slab in cache.stats()['slabs'].values()]
+        self.assertLessEqual(sum(budgets), 16 * 256 * 1024)
+
+
+class StaleWhileRevalidateTest(unittest.TestCase):
+    def test_stale_value_is_served_and_refreshed(self):
+        cache = InMemoryCache(max_size=16, refresh=lambda key: 'new')
+        cache.put('k', 'old', ttl=1, stale_ttl=60)
+
+        with _clock_after(2):
+            self.assertEqual(cache.lookup('k'), ('old', False))
+            _wait_for_refreshes(cache)
+            self.assertEqual(cache.lookup('k'), ('new', True))
+
+    def test_value_past_stale_window_is_gone(self):
+        cache = InMemoryCache(max_size=16, refresh=lambda key: 'new')
+        cache.put('k', 'old', ttl=1, stale_ttl=1)
+
+        with _clock_after(3):
+            self.assertEqual(cache.lookup('k'), (None, False))
+            self.assertFalse(cache._refreshing)
+
+    def test_one_refresh_in_flight_per_key(self):
+        release = threading.Event()
+        calls = []
+
+        def refresh(key):
+            calls.append(key)
+            release.wait(5)
+            return 'new'
+
+        cache = InMemoryCache(max_size=16, refresh=refresh)
+        cache.put('k', 'old', ttl=1, stale_ttl=60)
+
+        with _clock_after(2):
+            for _ in range(5):
+                self.assertEqual(cache.get('k'), 'old')
+            release.set()
+            _wait_for_refreshes(cache)
+
+        self.assertEqual(calls, ['k'])
+
+    def test_failed_refresh_is_logged_and_backed_off(self):
+        calls = []
+
+        def refresh(key):
+            calls.append(key)
+            raise RuntimeError('backend down')
+
+        cache = InMemoryCache(max_size=16, refresh=refresh)
+        cache.put('k', 'old', ttl=1, stale_ttl=60)
+
+        with _clock_after(2), self.assertLogs('InMemoryCache', 'ERROR') as logs:
+            for _ in range(5):
+                self.assertEqual(cache.get('k'), 'old')
+                _wait_for_refreshes(cache)
+
+        self.assertEqual(calls, ['k'])
+        self.assertIn('backend down', logs.output[0])
+
+        # Once the back-off has passed the key is refreshed again
+        cache._refresh_retry_at['k'] = 0
+        with _clock_after(2), self.assertLogs('InMemoryCache', 'ERROR'):
+            cache.get('k')
+            _wait_for_refreshes(cache)
+        self.assertEqual(calls, ['k', 'k'])
+
+
+class PutGetTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.client.delete('/cache')
+
+    def test_wide_integer_round_trips(self):
+        value = 2 ** 70
+        response = self.client.put('/cache/wide', json={'value': value})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get('/cache/wide')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'"value":1180591620717411303424,', response.data)
+        self.assertEqual(response.get_json()['value'], value)
+
+    def test_non_finite_numbers_are_rejected(self):
+        for body in (b'{"value": NaN}', b'{"value": [-Infinity]}', b'{"value": 1e400}', b'{"value":'):
+            response = self.client.put('/cache/bad', data=body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(self.client.get('/cache/bad').status_code, 404)
+
+    def test_floats_round_trip(self):
+        self.client.put('/cache/float', json={'value': [1.5, -2e-300, 1e300]})
+        self.assertEqual(self.client.get('/cache/float').get_json()['value'], [1.5, -2e-300, 1e300])
+
+    def test_huge_ttl_is_stored(self):
+        response = self.client.put('/cache/long-lived', json={'value': 'new', 'ttl': 10_000_000_000})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get('/cache/long-lived').get_json()['value'], 'new')
+
+    def test_cache_control_follows_ttl(self):
+        self.client.put('/cache/short', json={'value': 'x', 'ttl': 60})
+        self.assertIn(self.client.get('/cache/short').headers['Cache-Control'], ('max-age=60', 'max-age=59'))
+
+        self.client.put('/cache/forever', json={'value': 'x', 'ttl': 0})
+        response = self.client.get('/cache/forever')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertIn('ETag', response.headers)
+
+    def test_etag_is_weak(self):
+        self.client.put('/cache/tagged', json={'value': 'x'})
+
+        response = self.client.get('/cache/tagged')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.get('/cache/tagged', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_raw_body_keeps_content_type(self):
+        content_type = 'text/plain; charset=latin-1'
+        body = 'caf\xe9'.encode('latin-1')
+        response = self.client.put('/cache/raw?raw=1', data=body, content_type=content_type)
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get('/cache/raw')
+        self.assertEqual(response.data, body)
+        self.assertEqual(response.headers['Content-Type'], content_type)
+
+    def test_raw_body_is_not_rendered_by_browsers(self):
+        self.client.put('/cache/page?raw=1', data=b'<script>alert(1)</script>', content_type='text/html')
+
+        response = self.client.get('/cache/page')
+        self.assertEqual(response.headers['X-Content-Type-Options'], 'nosniff')
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment')
+
+    def test_overlong_content_type_is_rejected(self):
+        content_type = 'application/x-' + 'a' * 0xFFFF
+        response = self.client.put('/cache/long?raw=1', data=b'x', content_type=content_type)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/cache/long').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()